@@ -17,17 +17,23 @@ __author__ = "Trevor Maco <tmaco@cisco.com>"
 __copyright__ = "Copyright (c) 2023 Cisco and/or its affiliates."
 __license__ = "Cisco Sample Code License, Version 1.1"
 
+import asyncio
 import datetime
+import itertools
 import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from io import BytesIO
 
 import requests
-import xlsxwriter
-from flask import Flask, request, render_template, Response, jsonify
+from flask import Flask, request, render_template, Response, jsonify, make_response, send_file, abort
 from rich.console import Console
 from rich.panel import Panel
+from rich.traceback import Traceback
+from waitress import serve
 
-from catalyst_client import CatalystClientInfo
 from config import *
 from meraki_client import MerakiClientInfo
 
@@ -35,66 +41,242 @@ from meraki_client import MerakiClientInfo
 app = Flask(__name__)
 app.config['JSON_SORT_KEYS'] = False
 
-# Form Submission Results
-meraki_details = None
-cat_details = None
+# Form Submission State (per browser, keyed by the job_id cookie, least recently started jobs evicted first)
+app.config['STATE'] = OrderedDict()
+state_lock = threading.Lock()
+
+# Maximum browsers with job state kept (each job holds full Catalyst and Meraki results)
+MAX_JOBS = 64
+
+# Submission generation counter (progress streams wait for a job newer than the page they were opened from)
+job_generations = itertools.count(1)
+
+# Progress streams end after this long (seconds), so abandoned streams don't hold a server thread
+STREAM_TIMEOUT = 300
+
+# Waitress worker threads (each open progress stream holds one until it ends)
+SERVER_THREADS = 16
+
+# Rich Console Instance (no-op when QUIET)
+console = Console(quiet=QUIET)
+
+# Bounded worker pool for switch scans (reused across requests)
+SWITCH_EXECUTOR = ThreadPoolExecutor(max_workers=min(32, max(1, len(SWITCH_INFO))))
+
+# Progress JSON bodies for each progress step
+PROGRESS_BODIES = {progress: f'{{"progress": {progress}}}'.encode() for progress in (0, 25, 50, 75, 100)}
+
+# Time period dropdown values in seconds ('' is the default, 24 hours)
+TIME_PERIODS = {
+    '': 24 * 3600,
+    '24 Hours': 24 * 3600,
+    '72 Hours': 72 * 3600,
+    '1 Week': 7 * 24 * 3600
+}
+
+# Excel Field/Value rows: (label, value getter)
+CATALYST_CLIENT_FIELDS = [
+    ('Status', lambda d: 'Online'),
+    ('Mac Address', lambda d: d.mac),
+    ('IP Address', lambda d: d.lan_ip),
+    ('VLAN', lambda d: d.vlan),
+    ('Switch Hostname', lambda d: d.switch_hostname),
+    ('Interface', lambda d: d.interface),
+    ('Interface Status', lambda d: d.interface_status.get('status')),
+    ('Interface Mode', lambda d: d.interface_status.get('mode')),
+    ('Allowed VLANs', lambda d: d.interface_status.get('allowed_vlans'))
+]
+
+MERAKI_CLIENT_FIELDS = [
+    ('Status', lambda d: d.status),
+    ('Mac Address', lambda d: d.mac),
+    ('IP Address', lambda d: d.ip),
+    ('VLAN', lambda d: d.vlan),
+    ('Device Manufacturer', lambda d: d.manufacturer),
+    ('Device OS', lambda d: d.os),
+    ('Device User', lambda d: d.user),
+    ('Device Description', lambda d: d.description),
+    ('Recent Device (Serial)', lambda d: d.recentDeviceSerial),
+    ('Recent Device (Name)', lambda d: d.recentDeviceName),
+    ('Connection Type', lambda d: d.recentDeviceConnection)
+]
+MERAKI_WIRED_CLIENT_FIELDS = MERAKI_CLIENT_FIELDS + [('Switchport', lambda d: d.switchport)]
+MERAKI_WIRELESS_CLIENT_FIELDS = MERAKI_CLIENT_FIELDS + [('SSID', lambda d: d.ssid)]
+
+# Excel downloads built off the request thread: {download job id: (future, file name)}
+EXCEL_EXECUTOR = ThreadPoolExecutor(max_workers=4)
+EXCEL_JOBS = OrderedDict()
+excel_jobs_lock = threading.Lock()
+
+# Maximum Excel builds kept waiting for download
+MAX_EXCEL_JOBS = 32
+
+# Largest workbook built in constant_memory mode (one temp file stays open per sheet until close, up to 4 builds run
+# at once), bigger workbooks are built in memory to stay clear of the open file limit
+CONSTANT_MEMORY_MAX_SHEETS = 16
+
+# Pooled HTTP session for geo lookups
+http_session = requests.Session()
+
+# Server location and timezone (looked up once per process)
+geo_cache = None
+geo_lock = threading.Lock()
+
+
+def new_job():
+    """
+    Start (or restart) the form submission state for the requesting browser
+    :return: Job ID (cookie value), job state dictionary
+    """
+    job_id = request.cookies.get('job_id') or uuid.uuid4().hex
+
+    job = {
+        'progress': 0,
+        'cat': None,
+        'meraki': None,
+        # Guards result writes from worker threads
+        'lock': threading.Lock(),
+        # Set once a switch reports the client (remaining switch scans are skipped)
+        'found': threading.Event(),
+        # Set on every progress update (wakes the progress stream)
+        'updated': threading.Event()
+    }
+    with state_lock:
+        job['generation'] = next(job_generations)
+        previous = app.config['STATE'].pop(job_id, None)
+        app.config['STATE'][job_id] = job
+
+        # Wake progress streams still waiting on the replaced job
+        if previous:
+            previous['updated'].set()
+
+        # Drop the oldest jobs beyond the limit
+        while len(app.config['STATE']) > MAX_JOBS:
+            app.config['STATE'].popitem(last=False)
+
+    return job_id, job
+
+
+def set_progress(job, progress):
+    """
+    Update job progress and notify the progress stream
+    :param job: Job state dictionary
+    :param progress: New progress value (percentage)
+    :return:
+    """
+    with job['lock']:
+        job['progress'] = progress
+
+    job['updated'].set()
+
 
-# Rich Console Instance
-console = Console()
+def event_stream(job_id, after):
+    """
+    Yield job progress as Server-Sent Events until the job completes (or STREAM_TIMEOUT passes)
+    :param job_id: Job ID (cookie value, None if no submission is tracked for this browser)
+    :param after: Generation of the job the page was rendered with (its submission replaces that job)
+    :return: Generator of SSE messages
+    """
+    deadline = time.monotonic() + STREAM_TIMEOUT
+
+    while time.monotonic() < deadline:
+        # Look up the job every time (a new submission replaces the job state for this browser)
+        job = app.config['STATE'].get(job_id)
+        if job is None:
+            yield 'data: 0\n\n'
+            return
+
+        # Clear before reading, so an update landing after the read still wakes the wait below
+        job['updated'].clear()
 
-# Global lock
-lock = threading.Lock()
+        # Job from before the submission (the new one has not replaced it yet)
+        progress = 0 if job['generation'] <= after else job['progress']
 
-# Global progress variable
-progress = 0
+        yield f'data: {progress}\n\n'
 
+        if progress >= 100:
+            return
 
-def catalyst_client_information(mac, ip, switch):
+        # Wait for the next update (re-send the current value every second otherwise)
+        job['updated'].wait(timeout=1)
+
+
+def current_job():
+    """
+    Get the form submission state for the requesting browser
+    :return: Job state dictionary (None if no submission is tracked for this browser)
+    """
+    return app.config['STATE'].get(request.cookies.get('job_id'))
+
+
+def catalyst_client_information(mac, ip, switch, job):
     """
     Build Catalyst Client Object, contains details
     :param mac: Client MAC
     :param ip: Client IP Address
     :param switch: Current Switch Connection Info (netmiko)
+    :param job: Job state dictionary (receives the client object)
     :return:
     """
-    global cat_details
+    # Client already located on another switch
+    if job['found'].is_set():
+        return
 
     # Determine if switch contains target, extract information
+    # (imported on first lookup: netmiko, paramiko and ntc-templates are slow to import)
+    from catalyst_client import CatalystClientInfo
     cat_client = CatalystClientInfo(mac, ip)
 
     # Connect to device via ssh
     connection = cat_client.connectToSwitch(switch)
 
     if connection:
-        # Check if client present on switch
-        present = cat_client.clientPresentCheck()
+        # Only pool the session again if every command completed
+        reuse = False
+        try:
+            # Check if client present on switch (skipped if client located on another switch while connecting)
+            present = not job['found'].is_set() and cat_client.clientPresentCheck()
 
-        # Client found
-        if present:
-            # Extract information about client
-            cat_client.hostname()
-            cat_client.arpTable()
-            cat_client.macAddressTable()
-            cat_client.interfaceStatus()
-            cat_client.neighborInformation()
+            if present:
+                # Extract information about client (if this fails, other switches still run their lookup)
+                cat_client.collect_all()
 
-            # Disconnect from client
-            cat_client.disconnectFromSwitch()
+                # Client found, first switch to finish collecting claims the lookup (other workers skip remaining work)
+                with job['lock']:
+                    if not job['found'].is_set():
+                        job['cat'] = cat_client
+                        job['found'].set()
 
-            # Set client equal to global variable (once the thread has the lock)
-            with lock:
-                cat_details = cat_client
+            reuse = True
+        finally:
+            # Release switch session back to the pool for the next lookup (closed instead after an exception)
+            cat_client.disconnectFromSwitch(reuse)
 
 
-def meraki_client_information(mac, time_period):
+def log_failed_scans(futures):
+    """
+    Print the traceback of every finished switch scan that raised
+    :param futures: Dictionary of switch scan futures to switch ip (cancelled and still running scans are skipped)
+    :return:
+    """
+    for future, switch_ip in futures.items():
+        if future.cancelled() or not future.done():
+            continue
+
+        error = future.exception()
+        if error:
+            console.print(f'[red]Switch scan failed for {switch_ip}:[/]')
+            console.print(Traceback.from_exception(type(error), error, error.__traceback__))
+
+
+def meraki_client_information(mac, time_period, job):
     """
     Build Meraki Client Object, contains details and usage data
     :param mac: Client Mac Address
     :param time_period: Time Period for data query
+    :param job: Job state dictionary (receives the client object and progress)
     :return:
     """
-    global meraki_details, progress
-
     # Get Meraki client information and usage
     meraki_client = MerakiClientInfo(mac, time_period)
 
@@ -103,266 +285,166 @@ def meraki_client_information(mac, time_period):
     # Get meraki client details for client mac address across all networks
     meraki_client.client_detail_history()
 
-    progress = 50
+    set_progress(job, 50)
 
     console.print(Panel.fit(f"Getting App Usage History", title="Step 3"))
 
     # Get application information for client mac address across all networks
     meraki_client.app_usage_history()
 
-    progress = 75
+    with job['lock']:
+        job['meraki'] = meraki_client
 
-    meraki_details = meraki_client
+    set_progress(job, 75)
 
 
 # Methods
 def getSystemTimeAndLocation():
     """Returns location and time of accessing device"""
-    # request user ip
-    userIPRequest = requests.get('https://get.geojs.io/v1/ip.json')
-    userIP = userIPRequest.json()['ip']
+    global geo_cache
 
-    # request geo information based on ip
-    geoRequestURL = 'https://get.geojs.io/v1/ip/geo/' + userIP + '.json'
-    geoRequest = requests.get(geoRequestURL)
-    geoData = geoRequest.json()
+    # Location and timezone don't change while the app runs, only look them up once
+    if geo_cache is None:
+        with geo_lock:
+            if geo_cache is None:
+                # request user ip
+                userIPRequest = http_session.get('https://get.geojs.io/v1/ip.json')
+                userIP = userIPRequest.json()['ip']
+
+                # request geo information based on ip
+                geoRequestURL = 'https://get.geojs.io/v1/ip/geo/' + userIP + '.json'
+                geoRequest = http_session.get(geoRequestURL)
+                geoData = geoRequest.json()
+
+                geo_cache = (geoData['country'], geoData['timezone'])
 
     # create info string
-    location = geoData['country']
-    timezone = geoData['timezone']
+    location, timezone = geo_cache
     current_time = datetime.datetime.now().strftime("%d %b %Y, %I:%M %p")
     timeAndLocation = "System Information: {}, {} (Timezone: {})".format(location, current_time, timezone)
 
     return timeAndLocation
 
 
-def convert_to_sec(time_period):
-    """
-    Convert time period from submission form to seconds (required by Meraki API usage call)
-    :param time_period: Specified in submission form (24h, 72h, 1 week, or custom)
-    :return: Time period in seconds
-    """
-    # Default Case (return 24 hours)
-    if time_period == '':
-        return 24 * 3600
-    # Hours case
-    elif 'Hours' in time_period:
-        hour = int(time_period.split(' ')[0])
-        return hour * 3600
-    elif 'Week' in time_period:
-        week = int(time_period.split(' ')[0])
-        return week * 7 * 24 * 3600
-    # Custom interval case (hours)
-    else:
-        return int(time_period) * 3600
-
-
-# Flask Routes
-@app.route('/')
-def index():
+def submit_excel_job(build_workbook, details, file_name):
     """
-    Homepage: Clear global variables on load
-    :return:
+    Build Excel file on the Excel worker pool
+    :param build_workbook: Workbook build function
+    :param details: Client object passed to the build function
+    :param file_name: Download file name
+    :return: Download job ID
     """
-    global cat_details, meraki_details, progress
+    excel_job_id = uuid.uuid4().hex
 
-    # Clear global objects
-    cat_details = None
-    meraki_details = None
+    with excel_jobs_lock:
+        EXCEL_JOBS[excel_job_id] = (EXCEL_EXECUTOR.submit(build_workbook, details), file_name)
 
-    progress = 0
+        # Drop the oldest builds that were never downloaded
+        while len(EXCEL_JOBS) > MAX_EXCEL_JOBS:
+            EXCEL_JOBS.popitem(last=False)
 
-    return render_template('index.html', hiddenLinks=False, timeAndLocation=getSystemTimeAndLocation(),
-                           table_flag=False)
+    return excel_job_id
 
 
-@app.route('/display', methods=["POST"])
-def submit():
+def workbook_options(sheet_count):
     """
-    Handle form submission: query Meraki for application usage data for each network, generate summary table,
-    return table information to webpage
-    :return: A List of tables containing usage data (paginated at 1 by default)
+    Excel workbook options for a workbook with the given number of sheets
+    :param sheet_count: Number of sheets in the workbook
+    :return: xlsxwriter Workbook options (constant_memory only for small workbooks)
     """
-    global cat_details, meraki_details, progress
-
-    # Clear global objects
-    cat_details = None
-    meraki_details = None
+    return {'constant_memory': sheet_count <= CONSTANT_MEMORY_MAX_SHEETS}
 
-    progress = 0
 
-    mac_address = request.form['mac_address']
-    ip_address = request.form['ip_address']
-    time_period = request.form['time_period']
-    custom_period = request.form['custom-interval']
-
-    console.print(Panel.fit("Submission Detected:"))
-    console.print(
-        f"For mac: [blue]{mac_address}[/], or optional ip: [yellow]{ip_address}[/], with Time Period: [yellow]{time_period}[/], and optional Custom "
-        f"Period: [yellow]{custom_period}[/]")
-
-    # Select custom value if present
-    if len(custom_period) != 0:
-        seconds = convert_to_sec(custom_period)
-    else:
-        seconds = convert_to_sec(time_period)
-
-    # Set MAC address to none if IP provided, else set IP to None
-    if len(ip_address) != 0:
-        mac_address = None
-    else:
-        ip_address = None
-
-    console.print(Panel.fit(f"Getting Catalyst Client Details", title="Step 1"))
-
-    # Get catalyst client details for client mac address (disconnect from switch if data is found) - search all switches
-    threads = []
-    for switch in SWITCH_INFO:
-        t = threading.Thread(target=catalyst_client_information, args=(mac_address, ip_address, switch,))
-        threads.append(t)
-
-    # Start all threads
-    for x in threads:
-        x.start()
-
-    # Wait for all of them to finish
-    for x in threads:
-        x.join()
-
-    progress = 25
-
-    # Extract local mac and convert if only IP is provided
-    if not mac_address and cat_details:
-        mac_address = cat_details.mac.replace('.', '')
-        mac_address = ":".join([mac_address[i:i + 2] for i in range(0, len(mac_address), 2)])
-
-    # Get Meraki Client Information
-    meraki_client_information(mac_address, seconds)
-
-    console.print(Panel.fit(f"Constructing Usage and Client Data Tables", title="Step 4"))
-
-    # Catalyst Details Section
-    if cat_details:
-        # CDP Table
-        cat_details_cdp = ('cdp', cat_details.cdp)
-
-        # LLDP Table
-        cat_details_lldp = ('lldp', cat_details.lldp)
-
-    else:
-        cat_details_cdp = None
-        cat_details_lldp = None
-
-    # Meraki Details Section
-    # Get details sorted correctly
-    network_client_details = []
-    for network in meraki_details.sorted_net_names:
-        target_data = {}
-        for net in meraki_details.clientDetails['networks']:
-            if net['network_name'] == network:
-                target_data = net
-                break
-
-        if len(target_data) > 0:
-            network_client_details.append((network, target_data['client_details']))
-        else:
-            network_client_details.append((network, None))
-
-    # Usage Section
-    summary_applications = ('summary', meraki_details.usage['summary'], meraki_details.usage_pie_chart['summary'])
-
-    # Add all other network information
-    network_applications = []
-    for network in meraki_details.sorted_net_names:
-        for net in meraki_details.usage['networks']:
-            if net['network_name'] == network:
-                target_usage = net['applications']
-                break
-
-        for net in meraki_details.usage_pie_chart['networks']:
-            if net['network_name'] == network:
-                target_usage_pie_chart = net['applications']
-                break
+def write_fields(sheet, fields, details):
+    """
+    Write Field/Value rows to an Excel sheet (missing values written as 'None')
+    :param sheet: Excel worksheet
+    :param fields: List of (label, value getter) tuples
+    :param details: Client details passed to each value getter
+    :return:
+    """
+    for row, (label, get_value) in enumerate(fields, start=1):
+        value = get_value(details)
 
-        network_applications.append((network, target_usage, target_usage_pie_chart))
+        sheet.write_string(row, 0, label)
+        sheet.write_string(row, 1, str(value) if value else 'None')
 
-    progress = 100
 
-    # Render template with pagination links and data for the requested page
-    return render_template('index.html', hiddenLinks=False, timeAndLocation=getSystemTimeAndLocation(), table_flag=True,
-                           network_names=meraki_details.sorted_net_names,
-                           mac_address=meraki_details.mac,
-                           summary_table=summary_applications, network_tables=network_applications,
-                           details_tables=network_client_details, cat_details_table=cat_details,
-                           cat_details_table_cdp=cat_details_cdp, cat_details_table_lldp=cat_details_lldp)
+def index_networks(networks, key):
+    """
+    Index per-network results by network name
+    :param networks: List of network dictionaries (network_name and data)
+    :param key: Data key to index
+    :return: Dictionary mapping network name to data
+    """
+    return {net['network_name']: net[key] for net in networks}
 
 
-@app.route('/progress')
-def get_progress():
+def convert_to_sec(time_period):
     """
-    Get current process progress for progress bar display
-    :return:
+    Convert time period from submission form to seconds (required by Meraki API usage call)
+    :param time_period: Specified in submission form (24h, 72h, 1 week, or custom)
+    :return: Time period in seconds
     """
-    global progress
-
-    # Return the progress as a JSON response
-    return jsonify({'progress': progress})
+    # Dropdown values and default case (24 hours)
+    if time_period in TIME_PERIODS:
+        return TIME_PERIODS[time_period]
+    # Hours case
+    elif 'Hours' in time_period:
+        hour = int(time_period.split(' ')[0])
+        return hour * 3600
+    elif 'Week' in time_period:
+        week = int(time_period.split(' ')[0])
+        return week * 7 * 24 * 3600
+    # Custom interval case (hours)
+    else:
+        return int(time_period) * 3600
 
 
-@app.route('/download/client/catalyst')
-def download_catalyst_client():
+def build_catalyst_client_workbook(cat_details):
     """
-    Download Excel file containing catalyst client information seen in WebGUI Tables (event triggered by download button)
-    :return: Excel File
+    Build Excel file containing catalyst client information seen in WebGUI Tables (runs on the Excel worker pool)
+    :param cat_details: Catalyst Client Object (from job state)
+    :return: In-memory Excel file
     """
-    console.print(f"Downloading Excel File [green]catalyst_client_details.xlsx[/]")
+    console.print(f"Building Excel File [green]catalyst_client_details.xlsx[/]")
+
+    # Imported on first download (only needed here)
+    import xlsxwriter
 
     # Create in-memory file for writing Excel data
     output = BytesIO()
 
-    # Create Excel workbook and add sheets
-    workbook = xlsxwriter.Workbook(output, {'in_memory': True})
+    # Create Excel workbook and add sheets (rows are flushed as they are written)
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
     sheets = []
 
     # Catalyst Client Sheets
     sheet = workbook.add_worksheet('Catalyst Client Details')
     sheets.append(sheet)
 
+    # Header format (shared by all sheets)
+    header_format = workbook.add_format({'bold': True, 'bottom': 2})
+
     # Define Column Headers (Catalyst Client Details)
     fields = ['Field', 'Value']
-    header_format = workbook.add_format({'bold': True, 'bottom': 2})
 
     # Write column headers
+    sheet.set_column(0, 1, 30)
     sheet.write_row(0, 0, fields, header_format)
 
     # Write Column Rows
     if cat_details:
-        sheet.write_row(1, 0, ['Status', 'Online'])
-        sheet.write_row(2, 0, ['Mac Address', cat_details.mac if cat_details.mac else 'None'])
-        sheet.write_row(3, 0, ['IP Address', cat_details.lan_ip if cat_details.lan_ip else 'None'])
-        sheet.write_row(4, 0, ['VLAN', cat_details.vlan if cat_details.vlan else 'None'])
-        sheet.write_row(5, 0,
-                        ['Switch Hostname', cat_details.switch_hostname if cat_details.switch_hostname else 'None'])
-        sheet.write_row(6, 0,
-                        ['Interface', cat_details.interface if cat_details.interface else 'None'])
-        sheet.write_row(7, 0,
-                        ['Interface Status',
-                         cat_details.interface_status['status'] if cat_details.interface_status['status'] else 'None'])
-        sheet.write_row(8, 0,
-                        ['Interface Mode',
-                         cat_details.interface_status['mode'] if cat_details.interface_status['mode'] else 'None'])
-        sheet.write_row(9, 0,
-                        ['Allowed VLANs', cat_details.interface_status['allowed_vlans'] if cat_details.interface_status[
-                            'allowed_vlans'] else 'None'])
+        write_fields(sheet, CATALYST_CLIENT_FIELDS, cat_details)
 
         sheet = workbook.add_worksheet('CDP Table')
         sheets.append(sheet)
 
         # Define Column Headers (Catalyst Client Details)
         fields = ['Neighbor', 'Local Interface', 'Capability', 'Platform', 'Neighbor Interface']
-        header_format = workbook.add_format({'bold': True, 'bottom': 2})
 
         # Write column headers
+        sheet.set_column(0, 4, 20)
         sheet.write_row(0, 0, fields, header_format)
 
         for j, val in enumerate(cat_details.cdp):
@@ -372,9 +454,9 @@ def download_catalyst_client():
         sheets.append(sheet)
 
         fields = ['Neighbor', 'Local Interface', 'Capability', 'Neighbor Interface']
-        header_format = workbook.add_format({'bold': True, 'bottom': 2})
 
         # Write column headers
+        sheet.set_column(0, 3, 20)
         sheet.write_row(0, 0, fields, header_format)
 
         for j, val in enumerate(cat_details.lldp):
@@ -383,30 +465,31 @@ def download_catalyst_client():
     # Set workbook properties
     workbook.set_properties({'title': 'Catalyst Client Details'})
 
-    # Close workbook and return Excel file as a response to the request
+    # Close workbook
     workbook.close()
 
-    console.print(f"[green]Download complete![/]")
+    console.print(f"[green]Excel File ready for download![/]")
 
-    # Return Excel file as a response to the request
-    response = Response(output.getvalue(), mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    response.headers.set('Content-Disposition', 'attachment', filename='catalyst_client_details.xlsx')
-    return response
+    output.seek(0)
+    return output
 
 
-@app.route('/download/client/meraki')
-def download_meraki_client():
+def build_meraki_client_workbook(meraki_details):
     """
-    Download Excel file containing meraki client information seen in WebGUI Tables (event triggered by download button)
-    :return: Excel File
+    Build Excel file containing meraki client information seen in WebGUI Tables (runs on the Excel worker pool)
+    :param meraki_details: Meraki Client Object (from job state)
+    :return: In-memory Excel file
     """
-    console.print(f"Downloading Excel File [green]meraki_client_details.xlsx[/]")
+    console.print(f"Building Excel File [green]meraki_client_details.xlsx[/]")
+
+    # Imported on first download (only needed here)
+    import xlsxwriter
 
     # Create in-memory file for writing Excel data
     output = BytesIO()
 
-    # Create Excel workbook and add sheets
-    workbook = xlsxwriter.Workbook(output, {'in_memory': True})
+    # Create Excel workbook and add sheets (rows are flushed as they are written, for small workbooks)
+    workbook = xlsxwriter.Workbook(output, workbook_options(len(meraki_details.sorted_net_names)))
     sheets = []
 
     # Add Network Sheets
@@ -418,80 +501,52 @@ def download_meraki_client():
     fields = ['Field', 'Value']
     header_format = workbook.add_format({'bold': True, 'bottom': 2})
 
-    for sheet in sheets:
-        target_dict = {}
+    # Index network client details by name
+    client_details_index = index_networks(meraki_details.clientDetails['networks'], 'client_details')
 
+    for sheet in sheets:
         # Get Network Sheet
-        for net in meraki_details.clientDetails['networks']:
-            if net['network_name'] == sheet.name:
-                target_dict = net['client_details']
+        target = client_details_index.get(sheet.name)
 
         # Write column headers
+        sheet.set_column(0, 1, 30)
         sheet.write_row(0, 0, fields, header_format)
 
         # Write Column Rows
-        if len(target_dict) > 0:
-            sheet.write_row(1, 0, ['Status', target_dict['status'] if target_dict['status'] else 'None'])
-            sheet.write_row(2, 0, ['Mac Address', target_dict['mac'] if target_dict['mac'] else 'None'])
-            sheet.write_row(3, 0, ['IP Address', target_dict['ip'] if target_dict['ip'] else 'None'])
-            sheet.write_row(4, 0, ['VLAN', target_dict['vlan'] if target_dict['vlan'] else 'None'])
-            sheet.write_row(5, 0,
-                            ['Device Manufacturer',
-                             target_dict['manufacturer'] if target_dict['manufacturer'] else 'None'])
-            sheet.write_row(6, 0,
-                            ['Device OS', target_dict['os'] if target_dict['os'] else 'None'])
-            sheet.write_row(7, 0,
-                            ['Device User',
-                             target_dict['user'] if target_dict['user'] else 'None'])
-            sheet.write_row(8, 0,
-                            ['Device Description',
-                             target_dict['description'] if target_dict['description'] else 'None'])
-            sheet.write_row(9, 0,
-                            ['Recent Device (Serial)',
-                             target_dict['recentDeviceSerial'] if target_dict['recentDeviceSerial'] else 'None'])
-            sheet.write_row(10, 0,
-                            ['Recent Device (Name)',
-                             target_dict['recentDeviceName'] if target_dict['recentDeviceName'] else 'None'])
-            sheet.write_row(11, 0,
-                            ['Connection Type', target_dict['recentDeviceConnection'] if target_dict[
-                                'recentDeviceConnection'] else 'None'])
-
-            if target_dict['recentDeviceConnection'] == 'Wired':
-                sheet.write_row(12, 0,
-                                ['Switchport', target_dict['switchport'] if target_dict[
-                                    'switchport'] else 'None'])
+        if target:
+            if target.recentDeviceConnection == 'Wired':
+                write_fields(sheet, MERAKI_WIRED_CLIENT_FIELDS, target)
             else:
-                sheet.write_row(12, 0,
-                                ['SSID', target_dict['ssid'] if target_dict[
-                                    'ssid'] else 'None'])
+                write_fields(sheet, MERAKI_WIRELESS_CLIENT_FIELDS, target)
 
     # Set workbook properties
     workbook.set_properties({'title': 'Meraki Client Details'})
 
-    # Close workbook and return Excel file as a response to the request
+    # Close workbook
     workbook.close()
 
-    console.print(f"[green]Download complete![/]")
+    console.print(f"[green]Excel File ready for download![/]")
 
-    # Return Excel file as a response to the request
-    response = Response(output.getvalue(), mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    response.headers.set('Content-Disposition', 'attachment', filename='meraki_client_details.xlsx')
-    return response
+    output.seek(0)
+    return output
 
 
-@app.route('/download/usage')
-def download_usage():
+def build_usage_workbook(meraki_details):
     """
-    Download Excel file containing app summary information seen in WebGUI Tables (event triggered by download button)
-    :return: Excel File
+    Build Excel file containing app summary information seen in WebGUI Tables (runs on the Excel worker pool)
+    :param meraki_details: Meraki Client Object (from job state)
+    :return: In-memory Excel file
     """
-    console.print(f"Downloading Excel File [green]meraki_client_app_usage.xlsx[/]")
+    console.print(f"Building Excel File [green]meraki_client_app_usage.xlsx[/]")
+
+    # Imported on first download (only needed here)
+    import xlsxwriter
 
     # Create in-memory file for writing Excel data
     output = BytesIO()
 
-    # Create Excel workbook and add sheets
-    workbook = xlsxwriter.Workbook(output, {'in_memory': True})
+    # Create Excel workbook and add sheets (rows are flushed as they are written, for small workbooks)
+    workbook = xlsxwriter.Workbook(output, workbook_options(len(meraki_details.sorted_net_names) + 1))
     sheets = []
 
     # Add Summary Sheet
@@ -507,10 +562,13 @@ def download_usage():
     fields = ['Application', 'Received', 'Sent']
     header_format = workbook.add_format({'bold': True, 'bottom': 2})
 
-    for sheet in sheets:
-        target_dict = {}
+    # Index network usage by name
+    usage_index = index_networks(meraki_details.usage['networks'], 'applications')
 
+    for sheet in sheets:
         # Write column headers
+        sheet.set_column(0, 0, 40)
+        sheet.set_column(1, 2, 15)
         sheet.write_row(0, 0, fields, header_format)
 
         # Write Summary Sheet
@@ -518,9 +576,7 @@ def download_usage():
             target_dict = meraki_details.usage['summary']
         # Write network sheet
         else:
-            for net in meraki_details.usage['networks']:
-                if net['network_name'] == sheet.name:
-                    target_dict = net['applications']
+            target_dict = usage_index.get(sheet.name, {})
 
         for j, (k, v_list) in enumerate(target_dict.items()):
             sheet.write_row(j + 1, 0, [k] + v_list)
@@ -528,16 +584,265 @@ def download_usage():
     # Set workbook properties
     workbook.set_properties({'title': 'Meraki App Usage'})
 
-    # Close workbook and return Excel file as a response to the request
+    # Close workbook
     workbook.close()
 
-    console.print(f"[green]Download complete![/]")
+    console.print(f"[green]Excel File ready for download![/]")
+
+    output.seek(0)
+    return output
 
-    # Return Excel file as a response to the request
-    response = Response(output.getvalue(), mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    response.headers.set('Content-Disposition', 'attachment', filename='meraki_client_app_usage.xlsx')
+
+# Flask Routes
+@app.route('/')
+def index():
+    """
+    Homepage: Clear job state on load
+    :return:
+    """
+    # Clear previous results for this browser
+    job_id, job = new_job()
+
+    response = make_response(render_template('index.html', hiddenLinks=False,
+                                             timeAndLocation=getSystemTimeAndLocation(), table_flag=False,
+                                             job_generation=job['generation']))
+    response.set_cookie('job_id', job_id)
     return response
 
 
+@app.route('/display', methods=["POST"])
+def submit():
+    """
+    Handle form submission: query Meraki for application usage data for each network, generate summary table,
+    return table information to webpage
+    :return: A List of tables containing usage data (paginated at 1 by default)
+    """
+    # Clear previous results for this browser
+    job_id, job = new_job()
+
+    try:
+        mac_address = request.form['mac_address']
+        ip_address = request.form['ip_address']
+        time_period = request.form['time_period']
+        custom_period = request.form['custom-interval']
+
+        console.print(Panel.fit("Submission Detected:"))
+        console.print(
+            f"For mac: [blue]{mac_address}[/], or optional ip: [yellow]{ip_address}[/], with Time Period: [yellow]{time_period}[/], and optional Custom "
+            f"Period: [yellow]{custom_period}[/]")
+
+        # Select custom value if present
+        if len(custom_period) != 0:
+            seconds = convert_to_sec(custom_period)
+        else:
+            seconds = convert_to_sec(time_period)
+
+        # Set MAC address to none if IP provided, else set IP to None
+        if len(ip_address) != 0:
+            mac_address = None
+        else:
+            ip_address = None
+
+        console.print(Panel.fit(f"Getting Catalyst Client Details", title="Step 1"))
+
+        # Get catalyst client details for client mac address - search all switches
+        if CATALYST_BACKEND == 'scrapli':
+            from catalyst_async import gather_all
+
+            # Single event loop drives every switch session (asyncssh)
+            job['cat'] = asyncio.run(gather_all(mac_address, ip_address, SWITCH_INFO))
+        else:
+            futures = {SWITCH_EXECUTOR.submit(catalyst_client_information, mac_address, ip_address, switch, job):
+                       switch['ip'] for switch in SWITCH_INFO}
+            pending = set(futures)
+
+            # Wait for switch scans, cancel queued scans once the client is located
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+                if job['found'].is_set():
+                    for future in pending:
+                        future.cancel()
+
+                    # Client details already stored by the claiming worker, don't wait on scans still running
+                    # (e.g. stuck connecting to an unreachable switch, they return early once connected)
+                    break
+
+            # Report scans that raised (worker exceptions are otherwise kept on the future)
+            log_failed_scans(futures)
+
+        set_progress(job, 25)
+        cat_details = job['cat']
+
+        # Extract local mac and convert if only IP is provided
+        if not mac_address and cat_details:
+            mac_address = cat_details.mac.replace('.', '')
+            mac_address = ":".join([mac_address[i:i + 2] for i in range(0, len(mac_address), 2)])
+
+        # Get Meraki Client Information
+        meraki_client_information(mac_address, seconds, job)
+        meraki_details = job['meraki']
+
+        console.print(Panel.fit(f"Constructing Usage and Client Data Tables", title="Step 4"))
+
+        # Catalyst Details Section
+        if cat_details:
+            # CDP Table
+            cat_details_cdp = ('cdp', cat_details.cdp)
+
+            # LLDP Table
+            cat_details_lldp = ('lldp', cat_details.lldp)
+
+        else:
+            cat_details_cdp = None
+            cat_details_lldp = None
+
+        # Index network results by name
+        client_details_index = index_networks(meraki_details.clientDetails['networks'], 'client_details')
+        usage_index = index_networks(meraki_details.usage['networks'], 'applications')
+        usage_pie_chart_index = index_networks(meraki_details.usage_pie_chart['networks'], 'applications')
+
+        # Meraki Details Section
+        # Get details sorted correctly
+        network_client_details = [(network, client_details_index.get(network))
+                                  for network in meraki_details.sorted_net_names]
+
+        # Usage Section
+        summary_applications = ('summary', meraki_details.usage['summary'], meraki_details.usage_pie_chart['summary'])
+
+        # Add all other network information
+        network_applications = [(network, usage_index.get(network, {}), usage_pie_chart_index.get(network, {}))
+                                for network in meraki_details.sorted_net_names]
+
+        # Render template with pagination links and data for the requested page
+        response = make_response(
+            render_template('index.html', hiddenLinks=False, timeAndLocation=getSystemTimeAndLocation(),
+                            table_flag=True, job_generation=job['generation'],
+                            network_names=meraki_details.sorted_net_names,
+                            mac_address=meraki_details.mac,
+                            summary_table=summary_applications, network_tables=network_applications,
+                            details_tables=network_client_details, cat_details_table=cat_details,
+                            cat_details_table_cdp=cat_details_cdp, cat_details_table_lldp=cat_details_lldp))
+        response.set_cookie('job_id', job_id)
+        return response
+    finally:
+        # Always complete the progress bar (including when the lookup fails)
+        set_progress(job, 100)
+
+
+@app.route('/progress')
+def get_progress():
+    """
+    Get current process progress for progress bar display
+    :return:
+    """
+    job = current_job()
+    progress = job['progress'] if job else 0
+
+    # Return the progress as a JSON response (precomputed for the known progress steps)
+    if progress in PROGRESS_BODIES:
+        return Response(PROGRESS_BODIES[progress], mimetype='application/json')
+
+    return jsonify({'progress': progress})
+
+
+@app.route('/progress/stream')
+def progress_stream():
+    """
+    Stream current process progress for progress bar display (Server-Sent Events, replaces polling /progress)
+    :return:
+    """
+    after = request.args.get('after', 0, type=int)
+
+    response = Response(event_stream(request.cookies.get('job_id'), after), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+@app.route('/download/client/catalyst')
+def download_catalyst_client():
+    """
+    Start building Excel file containing catalyst client information seen in WebGUI Tables (event triggered by
+    download button)
+    :return: Download job ID (file is served by /download/result/<job_id>)
+    """
+    job = current_job()
+    cat_details = job['cat'] if job else None
+
+    return jsonify({'job_id': submit_excel_job(build_catalyst_client_workbook, cat_details,
+                                               'catalyst_client_details.xlsx')})
+
+
+@app.route('/download/client/meraki')
+def download_meraki_client():
+    """
+    Start building Excel file containing meraki client information seen in WebGUI Tables (event triggered by download
+    button)
+    :return: Download job ID (file is served by /download/result/<job_id>)
+    """
+    job = current_job()
+    meraki_details = job['meraki'] if job else None
+
+    return jsonify({'job_id': submit_excel_job(build_meraki_client_workbook, meraki_details,
+                                               'meraki_client_details.xlsx')})
+
+
+@app.route('/download/usage')
+def download_usage():
+    """
+    Start building Excel file containing app summary information seen in WebGUI Tables (event triggered by download
+    button)
+    :return: Download job ID (file is served by /download/result/<job_id>)
+    """
+    job = current_job()
+    meraki_details = job['meraki'] if job else None
+
+    return jsonify({'job_id': submit_excel_job(build_usage_workbook, meraki_details, 'meraki_client_app_usage.xlsx')})
+
+
+@app.route('/download/status/<job_id>')
+def download_status(job_id):
+    """
+    Get Excel build status for a download job (polled by the download buttons)
+    :param job_id: Download job ID
+    :return: Build status (done once the file can be downloaded)
+    """
+    with excel_jobs_lock:
+        excel_job = EXCEL_JOBS.get(job_id)
+
+    if excel_job is None:
+        abort(404)
+
+    return jsonify({'done': excel_job[0].done()})
+
+
+@app.route('/download/result/<job_id>')
+def download_result(job_id):
+    """
+    Download Excel file built by a download job (202 while the build is still running)
+    :param job_id: Download job ID
+    :return: Excel File
+    """
+    with excel_jobs_lock:
+        excel_job = EXCEL_JOBS.get(job_id)
+
+        # Keep unfinished builds until they can be downloaded
+        if excel_job is not None and excel_job[0].done():
+            del EXCEL_JOBS[job_id]
+
+    if excel_job is None:
+        abort(404)
+
+    future, file_name = excel_job
+
+    if not future.done():
+        return jsonify({'done': False}), 202
+
+    # Return Excel file as a response to the request (streamed from the buffer, no copy)
+    return send_file(future.result(), mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+                     as_attachment=True, download_name=file_name)
+
+
 if __name__ == '__main__':
-    app.run(port=5000)
+    # Production WSGI server, threaded so /progress and downloads stay responsive during /display
+    serve(app, host='0.0.0.0', port=5000, threads=SERVER_THREADS)
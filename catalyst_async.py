@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>"
+__copyright__ = "Copyright (c) 2023 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import asyncio
+
+from rich.console import Console
+from scrapli.driver.core import AsyncIOSXEDriver
+
+from catalyst_client import CatalystClientInfo, check_command_output
+from config import QUIET
+
+# Rich Console Instance (no-op when QUIET)
+console = Console(quiet=QUIET)
+
+# Maximum concurrent switch sessions
+MAX_SWITCH_SESSIONS = 32
+
+
+def scrapli_device(switch):
+    """
+    Translate switch connection info (netmiko format) to scrapli driver arguments
+    :param switch: Switch Connection Info (netmiko)
+    :return: Dictionary of scrapli driver arguments
+    """
+    return {
+        "host": switch["ip"],
+        "auth_username": switch["username"],
+        "auth_password": switch["password"],
+        "auth_secondary": switch.get("secret", ""),
+        "auth_strict_key": False,
+        "transport": "asyncssh"
+    }
+
+
+async def execute_switch_batch(connection, commands):
+    """
+    Execute a batch of commands over the switch session
+    :param connection: Scrapli async connection object
+    :param commands: List of CLI commands to execute
+    :return: Dictionary mapping each command to its results (None if the command failed)
+    """
+    responses = await connection.send_commands(commands)
+
+    return {command: check_command_output(command, response.result, response.failed)
+            for command, response in zip(commands, responses)}
+
+
+async def catalyst_client_information(mac, ip, switch, sessions):
+    """
+    Build Catalyst Client Object for a single switch
+    :param mac: Client MAC
+    :param ip: Client IP Address
+    :param switch: Switch Connection Info (netmiko)
+    :param sessions: Semaphore bounding concurrent switch sessions
+    :return: Catalyst Client Object (None if client not found on switch)
+    """
+    cat_client = CatalystClientInfo(mac, ip)
+
+    async with sessions:
+        console.print(f'Connecting to Switch at [green]{switch["ip"]}[/]...')
+        try:
+            # Open session and enter privilege mode (auth_secondary)
+            connection = AsyncIOSXEDriver(**scrapli_device(switch))
+            await connection.open()
+        except Exception:
+            console.print(f'Unable to connect to switch [red]{switch["ip"]}[/], skipping...')
+            return None
+
+        console.print(f'[green]Connected to switch {switch["ip"]}![/]')
+
+        try:
+            # Check if client present on switch
+            command = cat_client.presenceCommand()
+            outputs = await execute_switch_batch(connection, [command])
+
+            if not cat_client.loadPresence(outputs[command]):
+                return None
+
+            # Batch 1: mac table lookup (skipped when the presence check already returned it)
+            command = cat_client.prepareMacLookup()
+            if command:
+                outputs = await execute_switch_batch(connection, [command])
+                cat_client.macAddressTable(outputs[command])
+
+            # Batch 2: remaining details
+            commands = cat_client.detailCommands()
+            outputs = await execute_switch_batch(connection, list(commands.values()))
+            cat_client.loadDetails({name: outputs[command] for name, command in commands.items()})
+
+            return cat_client
+        finally:
+            await connection.close()
+
+
+async def gather_all(mac, ip, switches):
+    """
+    Query all switches concurrently from a single event loop, stop once the client is located
+    :param mac: Client MAC
+    :param ip: Client IP Address
+    :param switches: List of Switch Connection Info (netmiko)
+    :return: Catalyst Client Object (None if client not found on any switch)
+    """
+    sessions = asyncio.Semaphore(MAX_SWITCH_SESSIONS)
+    tasks = [asyncio.create_task(catalyst_client_information(mac, ip, switch, sessions)) for switch in switches]
+
+    try:
+        for task in asyncio.as_completed(tasks):
+            try:
+                cat_client = await task
+            except Exception as e:
+                # Lookup failed mid-session, skip switch
+                console.print(f'[red]Switch lookup failed[/]: {e}')
+                continue
+
+            if cat_client:
+                return cat_client
+
+        return None
+    finally:
+        # Client located (or all switches done), drop remaining sessions
+        for task in tasks:
+            task.cancel()
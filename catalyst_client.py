@@ -17,11 +17,142 @@ __author__ = "Trevor Maco <tmaco@cisco.com>"
 __copyright__ = "Copyright (c) 2023 Cisco and/or its affiliates."
 __license__ = "Cisco Sample Code License, Version 1.1"
 
+import os
+import re
+import threading
+import time
+
+import ntc_templates
+import textfsm
 from netmiko import ConnectHandler
 from rich.console import Console
 
-# Rich Console Instance
-console = Console()
+from config import QUIET
+
+# Rich Console Instance (no-op when QUIET)
+console = Console(quiet=QUIET)
+
+# ntc-templates directory (NET_TEXTFSM overrides, same as netmiko)
+TEMPLATE_DIR = os.environ.get('NET_TEXTFSM', os.path.join(os.path.dirname(ntc_templates.__file__), 'templates'))
+
+# Compiled TextFSM templates for parsed commands (keyed by command prefix): {prefix: (template, lowercase header)}
+_TEMPLATE_FILES = {
+    'show ip arp': 'cisco_ios_show_ip_arp.textfsm',
+    'show ip int br': 'cisco_ios_show_ip_interface_brief.textfsm',
+    'show cdp neighbors': 'cisco_ios_show_cdp_neighbors.textfsm',
+    'show lldp neighbors': 'cisco_ios_show_lldp_neighbors.textfsm'
+}
+_TEMPLATES = {}
+for _prefix, _file_name in _TEMPLATE_FILES.items():
+    with open(os.path.join(TEMPLATE_DIR, _file_name)) as _template_file:
+        _template = textfsm.TextFSM(_template_file)
+    _TEMPLATES[_prefix] = (_template, [column.lower() for column in _template.header])
+
+# TextFSM objects keep parser state, one parse at a time
+_template_lock = threading.Lock()
+
+# Idle SSH sessions kept open between requests, keyed by switch ip: {ip: (connection, last used time)}
+_switch_pool = {}
+_switch_pool_lock = threading.Lock()
+
+# Background sweep closing idle sessions (only scheduled while the pool holds sessions)
+_eviction_timer = None
+
+# Separators stripped from mac addresses before conversion to Catalyst format
+MAC_SEPARATORS = str.maketrans('', '', ':-.')
+
+# Marker command output delimiter for batched commands, time to wait for a whole batch (seconds)
+BATCH_MARKER = 'BATCH-MARKER'
+BATCH_READ_TIMEOUT = 30
+
+# Netmiko session options applied to every switch connection
+SWITCH_CONNECTION_OPTIONS = {
+    'fast_cli': True,
+    'global_cmd_verify': False
+}
+
+# Close pooled sessions idle for longer than this (seconds), sweep pool at this interval (seconds)
+SWITCH_IDLE_TIMEOUT = 600
+SWITCH_EVICTION_INTERVAL = 60
+
+
+def _schedule_eviction():
+    """
+    Schedule the next idle session sweep if the pool holds sessions (caller must hold the pool lock)
+    """
+    global _eviction_timer
+
+    if _eviction_timer is None and _switch_pool:
+        _eviction_timer = threading.Timer(SWITCH_EVICTION_INTERVAL, _evict_idle_sessions)
+        _eviction_timer.daemon = True
+        _eviction_timer.start()
+
+
+def _close_session(connection):
+    """
+    Close ssh session, ignoring errors from sessions the switch already dropped
+    :param connection: Netmiko ssh connection object
+    """
+    try:
+        connection.disconnect()
+    except Exception:
+        pass
+
+
+def _evict_idle_sessions():
+    """
+    Disconnect pooled switch sessions idle for longer than SWITCH_IDLE_TIMEOUT
+    """
+    global _eviction_timer
+
+    now = time.monotonic()
+    with _switch_pool_lock:
+        expired = [ip for ip, (_, last_used) in _switch_pool.items() if now - last_used > SWITCH_IDLE_TIMEOUT]
+        connections = [_switch_pool.pop(ip)[0] for ip in expired]
+
+        _eviction_timer = None
+        _schedule_eviction()
+
+    for connection in connections:
+        _close_session(connection)
+
+
+def parse_output(command, output):
+    """
+    Parse command output with the precompiled TextFSM template for the command
+    :param command: CLI command that produced the output
+    :param output: Raw command output
+    :return: List of dictionaries (one per row), or the raw output if the command has no template/nothing parsed
+    """
+    for prefix, (template, header) in _TEMPLATES.items():
+        if command.startswith(prefix):
+            with _template_lock:
+                template.Reset()
+                rows = template.ParseText(output)
+
+            if rows:
+                return [dict(zip(header, row)) for row in rows]
+            break
+
+    return output
+
+
+def check_command_output(command, output, failed=False):
+    """
+    Check if show output is valid, parse it
+    :param command: CLI command executed
+    :param output: Raw command output
+    :param failed: Command already reported as failed by the ssh backend
+    :return: Parsed command output (None if the command failed)
+    """
+    if failed or 'Invalid' in output:
+        console.print(f' - [red]Failed to execute "{command}"[/], please ensure the command(s) are correct!')
+        return None
+
+    # Per-command progress only for interactive sessions
+    if console.is_terminal:
+        console.print(f' - Executed [blue]"{command}"[/] successfully!')
+    return parse_output(command, output)
 
 
 def execute_switch_commands(connection, commands):
@@ -31,20 +162,41 @@ def execute_switch_commands(connection, commands):
     :param commands: CLI command to execute
     :return: String containing results of 'show run' command
     """
-    # Enter privilege mode
-    connection.enable()
-
-    # Send command
+    # Send command (session is already in privilege mode, see connectToSwitch)
     # TODO: could fail...
-    output = connection.send_command(commands, use_textfsm=True)
+    output = connection.send_command(commands)
 
-    # Check if show output is valid
-    if 'Invalid' in output:
-        console.print(f' - [red]Failed to execute "{commands}"[/], please ensure the command(s) are correct!')
-        return None
-    else:
-        console.print(f' - Executed [blue]"{commands}"[/] successfully!')
-        return output
+    return check_command_output(commands, output)
+
+
+def execute_switch_batch(connection, commands):
+    """
+    Execute several commands over the switch session in a single write (one round trip for the whole batch)
+    :param connection: Netmiko ssh connection object
+    :param commands: List of CLI commands to execute
+    :return: Dictionary mapping each command to its results (None if the command failed)
+    """
+    # Session is already in privilege mode (see connectToSwitch)
+    prompt = f'{connection.base_prompt}#'
+
+    # Follow each command with a numbered marker command (no output), its echoed line delimits the command outputs
+    markers = [f'{BATCH_MARKER}-{i}' for i in range(len(commands))]
+    payload = ''.join(f'{command}\nshow version | include {marker}\n' for command, marker in zip(commands, markers))
+
+    # Send whole batch, read until the prompt returns after the last marker
+    connection.write_channel(payload)
+    output = connection.read_until_pattern(pattern=rf'{markers[-1]}\s*[\r\n]+{re.escape(prompt)}',
+                                           read_timeout=BATCH_READ_TIMEOUT)
+    output = connection.normalize_linefeeds(output)
+
+    results = {}
+    for command, segment in zip(commands, re.split(rf'^.*{BATCH_MARKER}-\d+.*$', output, flags=re.M)):
+        # Drop echoed command line
+        segment = segment.strip('\n').partition('\n')[2].rstrip()
+
+        results[command] = check_command_output(command, segment)
+
+    return results
 
 
 def convert_mac(mac):
@@ -53,9 +205,8 @@ def convert_mac(mac):
     :param mac: mac address in meraki format
     :return: mac address in catalyst format
     """
-    converted_address = mac.replace(':', '').lower()
-    converted_address = ".".join([converted_address[i:i + 4] for i in range(0, len(converted_address), 4)])
-    return converted_address
+    converted_address = mac.translate(MAC_SEPARATORS).lower()
+    return f'{converted_address[:4]}.{converted_address[4:8]}.{converted_address[8:12]}'
 
 
 class CatalystClientInfo:
@@ -68,77 +219,167 @@ class CatalystClientInfo:
         self.lldp = []
         self.mac = convert_mac(mac) if mac else None
         self.lan_ip = ip
+        self.present_output = None
+        self.search_by_mac = self.mac is not None
+        self.switch_ip = None
         self.switch_connection = None
 
     def connectToSwitch(self, device_info):
+        self.switch_ip = device_info["ip"]
+
+        # Reuse pooled SSH session if one is idle for this switch (checked out until disconnectFromSwitch)
+        with _switch_pool_lock:
+            pooled = _switch_pool.pop(self.switch_ip, None)
+
+        if pooled:
+            if pooled[0].is_alive():
+                console.print(f'Reusing session to switch [green]{self.switch_ip}[/]')
+                self.switch_connection = pooled[0]
+                return self.switch_connection
+
+            # Switch dropped the idle session, open a new one
+            _close_session(pooled[0])
+
         # Start SSH session and login to device
         console.print(f'Connecting to Switch at [green]{device_info["ip"]}[/]...')
         try:
-            self.switch_connection = ConnectHandler(**device_info)
+            # Skip per-command echo verification (values in SWITCH_INFO take precedence)
+            self.switch_connection = ConnectHandler(**{**SWITCH_CONNECTION_OPTIONS, **device_info})
+
+            # Enter privilege mode once, the session stays there while pooled
+            self.switch_connection.enable()
         except Exception:
+            # Session opened but enable failed, close it (otherwise it holds a vty line)
+            if self.switch_connection:
+                _close_session(self.switch_connection)
+                self.switch_connection = None
+
             console.print(f'Unable to connect to switch [red]{device_info["ip"]}[/], skipping...')
             return None
 
         console.print(f'[green]Connected to switch {device_info["ip"]}![/]')
         return self.switch_connection
 
-    def disconnectFromSwitch(self):
-        # End SSH session
-        self.switch_connection.disconnect()
+    def disconnectFromSwitch(self, reuse=True):
+        # Session failed mid-command (unread output may still be on the channel), close it instead of pooling
+        if not reuse:
+            _close_session(self.switch_connection)
+            self.switch_connection = None
+            return
+
+        # Return SSH session to the pool (closed by the eviction sweep once idle)
+        with _switch_pool_lock:
+            if self.switch_ip in _switch_pool:
+                # Concurrent lookup already pooled a session for this switch, keep only one
+                surplus = self.switch_connection
+            else:
+                _switch_pool[self.switch_ip] = (self.switch_connection, time.monotonic())
+                surplus = None
+
+            _schedule_eviction()
+
+        if surplus:
+            _close_session(surplus)
+
+        self.switch_connection = None
 
     def clientPresentCheck(self):
+        # Check if client is present on switch (mac in Mac Address Table, or ip in ARP Table)
+        output = execute_switch_commands(self.switch_connection, self.presenceCommand())
+
+        return self.loadPresence(output)
+
+    def collect_all(self):
+        # Batch 1: mac table lookup (finds vlan and interface), skipped when the presence check already returned it
+        command = self.prepareMacLookup()
+        if command:
+            self.macAddressTable(execute_switch_commands(self.switch_connection, command))
+
+        # Batch 2: remaining details (depend on the interface)
+        commands = self.detailCommands()
+        outputs = execute_switch_batch(self.switch_connection, list(commands.values()))
+
+        self.loadDetails({name: outputs[command] for name, command in commands.items()})
+
+    def presenceCommand(self):
         if self.mac:
             # Check if Mac is present in Mac Address Table (indicates this is the right switch)
-            output = execute_switch_commands(self.switch_connection, f'show mac address-table | include {self.mac}')
+            return f'show mac address-table | include {self.mac}'
         else:
             # Check if ip is present in ARP Table (indicates this is the right switch)
-            output = execute_switch_commands(self.switch_connection, f'show ip arp | include {self.lan_ip}')
+            return f'show ip arp | include {self.lan_ip}'
+
+    def loadPresence(self, output):
+        # Keep output, the mac table lookup reuses it
+        self.present_output = output
 
         return output != ''
 
-    def hostname(self):
-        # Get hostname of switch
-        output = execute_switch_commands(self.switch_connection, 'show run | i hostname')
+    def prepareMacLookup(self):
+        # Mac searches: presence check output is the mac table entry, nothing left to send
+        if self.search_by_mac:
+            self.macAddressTable(self.present_output)
+            return None
 
+        # Ip searches: resolve the mac from the arp entry found by the presence check, then look up the mac table
+        self.arpTable(self.present_output)
+        return f'show mac address-table | include {self.mac}'
+
+    def detailCommands(self):
+        # Commands for the remaining details, keyed by detail name
+        commands = {
+            'hostname': 'show run | i hostname',
+            'status': f'show ip int br {self.interface}',
+            'trunk': f'show int {self.interface} trunk',
+            'cdp': 'show cdp neighbors',
+            'lldp': 'show lldp neighbors'
+        }
+
+        # Mac searches still need the ip from the arp table
+        if self.search_by_mac:
+            commands['arp'] = f'show ip arp | i {self.mac}'
+
+        return commands
+
+    def loadDetails(self, outputs):
+        # Set remaining details from command outputs (keyed like detailCommands)
+        self.hostname(outputs['hostname'])
+        if 'arp' in outputs:
+            self.arpTable(outputs['arp'])
+        self.interfaceStatus(outputs['status'], outputs['trunk'])
+        self.neighborInformation(outputs['cdp'], outputs['lldp'])
+
+    def hostname(self, output):
+        # Set hostname of switch
         if output:
             self.switch_hostname = output.strip().split()[1]
 
-    def macAddressTable(self):
-        # Get mac address table information
-        output = execute_switch_commands(self.switch_connection, f'show mac address-table | include {self.mac}')
+    def macAddressTable(self, output):
+        # Set new parameters based on Mac address table
         output = output.strip().split()
 
-        # Set new parameters based on Mac address table
         self.vlan = output[0]
         self.interface = output[3]
 
-    def arpTable(self):
+    def arpTable(self, output):
         if self.mac:
-            # Get show arp table information (for ip)
-            output = execute_switch_commands(self.switch_connection, f'show ip arp | i {self.mac}')
-
+            # Set ip from show arp table information
             if output and len(output) > 0:
                 self.lan_ip = output[0]['address']
         else:
-            # Get show arp table information (for mac)
-            output = execute_switch_commands(self.switch_connection, f'show ip arp | i {self.lan_ip}')
-
+            # Set mac from show arp table information
             if output and len(output) > 0:
                 self.mac = output[0]['mac']
 
-    def interfaceStatus(self):
-        # Get show interface status information, set status
-        output = execute_switch_commands(self.switch_connection, f'show ip int br {self.interface}')
-
-        if output and len(output) > 0:
-            self.interface_status['status'] = output[0]['status'] + '/' + output[0]['proto']
+    def interfaceStatus(self, status_output, trunk_output):
+        # Set status from show interface status information
+        if status_output and len(status_output) > 0:
+            self.interface_status['status'] = status_output[0]['status'] + '/' + status_output[0]['proto']
 
-        # Get show interface status information, set status
-        output = execute_switch_commands(self.switch_connection, f'show int {self.interface} trunk')
-
-        if output:
+        # Set mode/vlans from show interface trunk information
+        if trunk_output:
             # Split and remove empty entries
-            output = output.split('\n')
+            output = trunk_output.split('\n')
             output = [x for x in output if x]
 
             for line in output:
@@ -158,15 +399,11 @@ class CatalystClientInfo:
                     elif len(line) == 2 and "allowed_vlans" not in self.interface_status:
                         self.interface_status['allowed_vlans'] = line[1]
 
-    def neighborInformation(self):
-        # Get show interface status information, set status
-        output = execute_switch_commands(self.switch_connection, f'show cdp neighbors')
-
-        if output and len(output) > 0:
-            self.cdp = output
-
-        # Get show interface status information, set status
-        output = execute_switch_commands(self.switch_connection, f'show lldp neighbors')
+    def neighborInformation(self, cdp_output, lldp_output):
+        # Set cdp neighbors
+        if cdp_output and len(cdp_output) > 0:
+            self.cdp = cdp_output
 
-        if output and len(output) > 0:
-            self.lldp = output
+        # Set lldp neighbors
+        if lldp_output and len(lldp_output) > 0:
+            self.lldp = lldp_output
@@ -1,6 +1,11 @@
+import os
+
 MERAKI_API_KEY = ""
 ORG_NAME = ""
 
+# Optional: Meraki Org ID (skips looking up ORG_NAME)
+MERAKI_ORG_ID = ""
+
 # Catalyst Switch credentials, ip for netmiko (ssh)
 SWITCH_INFO = [
     {
@@ -11,3 +16,9 @@ SWITCH_INFO = [
         "secret": ""
     }
 ]
+
+# Catalyst query backend: "netmiko" (pooled sessions, thread per switch) or "scrapli" (asyncssh, single event loop)
+CATALYST_BACKEND = "netmiko"
+
+# Silence console output (set QUIET=1 in the environment for production)
+QUIET = os.environ.get("QUIET", "0") == "1"
@@ -17,17 +17,55 @@ __author__ = "Trevor Maco <tmaco@cisco.com>"
 __copyright__ = "Copyright (c) 2023 Cisco and/or its affiliates."
 __license__ = "Cisco Sample Code License, Version 1.1"
 
+import asyncio
+import functools
+import heapq
+import operator
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+
 import meraki
-from meraki import APIError
+import meraki.aio
+import numpy as np
+from meraki import APIError, AsyncAPIError
 from rich.console import Console
 
 from config import *
 
-# Rich Console Instance
-console = Console()
+# Rich Console Instance (no-op when QUIET)
+console = Console(quiet=QUIET)
+
+# Retries for rate limited (429) calls: the SDK waits for Retry-After first, then per-network fetches retry on top
+MAXIMUM_RETRIES = 5
+RATE_LIMIT_RETRIES = 3
 
 # Meraki Dashboard Instance
-dashboard = meraki.DashboardAPI(api_key=MERAKI_API_KEY, suppress_logging=True)
+dashboard = meraki.DashboardAPI(api_key=MERAKI_API_KEY, suppress_logging=True, single_request_timeout=60,
+                                wait_on_rate_limit=True, maximum_retries=MAXIMUM_RETRIES)
+
+# Network lists are cached per org for this long (seconds): {org_id: (fetch time, net_ids)}
+NETWORK_CACHE_TTL = 300
+_network_cache = {}
+
+# Org name -> org ID lookup, refreshed on the same TTL
+_orgs_by_name = {}
+_orgs_fetched = None
+
+# Org ID for ORG_NAME, resolved once (MERAKI_ORG_ID from config skips the lookup)
+_ORG_ID: str | None = MERAKI_ORG_ID or None
+
+# Network product types without LAN clients (networks with only these product types are skipped)
+CLIENTLESS_PRODUCT_TYPES = frozenset({'camera', 'sensor', 'systemsManager'})
+
+# Concurrent per-network API calls (matches the Meraki per-org rate limit of 5 requests/s)
+MAX_CONCURRENT_REQUESTS = 5
+
+# Background event loop and async dashboard shared by every lookup (aiohttp session and connections kept alive)
+_aio_loop = None
+_aiomeraki = None
+_aio_lock = threading.Lock()
 
 
 def convert_bytes(num):
@@ -46,35 +84,100 @@ def convert_bytes(num):
         return f"{num} KB"
 
 
-def get_network_ids(org_name):
+def convert_bytes_array(nums):
     """
-    Get network IDs in org
+    Convert a list of numbers from kilobytes (vectorized convert_bytes, same formatting)
+    :param nums: List of numbers in KB
+    :return: List of converted strings (same order)
+    """
+    raw = np.asarray(nums, dtype=np.float64)
+
+    # Pick unit per value and scale in one pass
+    gb_mask = raw >= 1024 * 1024
+    mb_mask = (raw >= 1024) & ~gb_mask
+    values = np.where(gb_mask, raw / (1024 * 1024), np.where(mb_mask, raw / 1024, raw))
+    units = np.where(gb_mask, 'GB', np.where(mb_mask, 'MB', 'KB'))
+
+    # Round with Python round (np.round differs for some values), KB values keep their original representation
+    return [f"{num} KB" if unit == 'KB' else f"{round(value, 2)} {unit}"
+            for num, value, unit in zip(nums, values.tolist(), units.tolist())]
+
+
+def get_org_id(org_name):
+    """
+    Get org ID for org name
     :param org_name: Org Name
-    :return: Network ID
+    :return: Org ID (None if org not found)
     """
-    # Get Meraki Org ID
-    orgs = dashboard.organizations.getOrganizations()
-    org_id = ''
-    for org in orgs:
-        if org['name'] == org_name:
-            org_id = org['id']
-            break
-
-    if org_id == '':
+    global _orgs_by_name, _orgs_fetched
+
+    # Get Meraki Org IDs (rebuild name lookup when stale)
+    if _orgs_fetched is None or time.monotonic() - _orgs_fetched >= NETWORK_CACHE_TTL:
+        orgs = dashboard.organizations.getOrganizations()
+
+        # First org wins when several share a name
+        _orgs_by_name = {}
+        for org in orgs:
+            _orgs_by_name.setdefault(org['name'], org['id'])
+        _orgs_fetched = time.monotonic()
+
+    return _orgs_by_name.get(org_name)
+
+
+def _resolve_org_id():
+    """
+    Get org ID for the configured org (resolved on first use, then reused)
+    :return: Org ID (None if org not found)
+    """
+    global _ORG_ID
+
+    if _ORG_ID is None:
+        _ORG_ID = get_org_id(ORG_NAME)
+
+    return _ORG_ID
+
+
+def get_network_ids(org_id):
+    """
+    Get network IDs in org
+    :param org_id: Org ID
+    :return: Network ID, name and product types (tuple, cached for NETWORK_CACHE_TTL seconds)
+    """
+    if org_id is None:
         return None
 
+    # Reuse recent network list
+    cached = _network_cache.get(org_id)
+    if cached and time.monotonic() - cached[0] < NETWORK_CACHE_TTL:
+        return cached[1]
+
     # Get Meraki Network IDs
     networks = dashboard.organizations.getOrganizationNetworks(organizationId=org_id)
-    net_ids = [(net_id['id'], net_id['name']) for net_id in networks]
+    net_ids = tuple((net_id['id'], net_id['name'], tuple(net_id.get('productTypes', ()))) for net_id in networks)
+
+    _network_cache[org_id] = (time.monotonic(), net_ids)
 
     return net_ids
 
 
+def clear_network_cache():
+    """
+    Drop cached org lookup, network lists and sorted network names (next lookup queries the API)
+    """
+    global _ORG_ID, _orgs_fetched
+
+    _ORG_ID = MERAKI_ORG_ID or None
+    _orgs_fetched = None
+    _network_cache.clear()
+    sorted_list_network_names.cache_clear()
+
+
+@functools.lru_cache(maxsize=16)
 def sorted_list_network_names(network_ids):
     """
-    Create list of sorted network names from usage dictionary
-    :param network_ids: tuple list of networks and ids
-    :return: List of sorted Network Names
+    Create list of sorted network names from usage dictionary (cached per network tuple)
+    :param network_ids: tuple of networks and ids
+    :return: Tuple of sorted Network Names
     """
     # Create list of network names
     network_names = [network[1] for network in network_ids]
@@ -82,62 +185,183 @@ def sorted_list_network_names(network_ids):
     # Sort networks alphabetically
     network_names = sorted(network_names, key=lambda d: d.lower())
 
-    return network_names
+    return tuple(network_names)
 
 
-def create_pie_chart_key(name, recv, sent):
+def create_pie_chart_key(name, total, recv, sent):
     """
     Create pie chart key name with format "app_name app_usage (app_download, app_usage)"
     :param name: App Name (raw)
-    :param recv: App Received (kilobytes)
-    :param sent: App Sent (kilobytes)
+    :param total: App Usage (kilobytes, received + sent)
+    :param recv: App Received (already converted)
+    :param sent: App Sent (already converted)
     :return: New App Name (with above format)
     """
-    # Build first part of string
-    usage_summary = convert_bytes(round(recv + sent, 1))
-
-    # Build second part of string
-    recv = convert_bytes(recv)
-    sent = convert_bytes(sent)
+    return f'{name} | {convert_bytes(total)} ({recv}, {sent})'
 
-    return f'{name} | {usage_summary} ({recv}, {sent})'
 
-
-def create_pie_chart_values(app_dict):
+def create_pie_chart_values(app_dict, label=None):
     """
     Create pie chart usage dictionary (largest 13 apps first, all other apps condensed into 'Other')
     :param app_dict: App Usage dictionary
+    :param label: Optional function (name, value) -> key, only applied to the selected apps
     :return: Chart friendly app usage dictionary
     """
-    # Sort the dictionary by values in descending order
-    sorted_dict = dict(sorted(app_dict.items(), key=lambda x: x[1], reverse=True))
-
-    # Determine the number of items to include in the new dictionary
-    num_items = min(len(sorted_dict), 13)
+    # Select the 13 largest values in descending order (no full sort)
+    top = heapq.nlargest(13, app_dict.items(), key=operator.itemgetter(1))
 
-    # Create a new dictionary with the specified number of items
-    new_dict = dict(list(sorted_dict.items())[:num_items])
+    # Create a new dictionary with the selected items
+    if label:
+        new_dict = {label(name, value): value for name, value in top}
+    else:
+        new_dict = dict(top)
 
-    # Check if there are values beyond the specified number of items
-    if len(sorted_dict) > num_items:
-        # Calculate the sum of the values beyond the specified number of items
-        other_value = sum(list(sorted_dict.values())[num_items:])
-        # Add the 'Other' entry to the new dictionary
-        new_dict['Other'] = other_value
+    # Check if there are values beyond the selected items
+    if len(app_dict) > len(top):
+        # Calculate the sum of the remaining values, add the 'Other' entry to the new dictionary
+        # (rounded like the app values, the subtraction leaves float noise)
+        new_dict['Other'] = round(sum(app_dict.values()) - sum(value for _, value in top), 1)
 
     return new_dict
 
 
+@dataclass(slots=True)
+class ClientDetail:
+    """
+    Minimized client details for one network (ssid only set for wireless clients, switchport only for wired)
+    """
+    description: str | None
+    ip: str | None
+    mac: str | None
+    user: str | None
+    manufacturer: str | None
+    os: str | None
+    recentDeviceSerial: str | None
+    recentDeviceName: str | None
+    recentDeviceConnection: str
+    status: str | None
+    vlan: int | str | None
+    ssid: str | None = None
+    switchport: str | None = None
+
+
+def search_org_client(org_id, mac):
+    """
+    Search client across the whole org, following every result page (Link header) and merging their records.
+    The SDK's total_pages='all' pager fails on this endpoint's dict responses (reads a missing 'pageStartAt')
+    :param org_id: Org ID
+    :param mac: Client Mac Address
+    :return: Client search response (records from all pages)
+    """
+    metadata = {
+        'tags': ['organizations', 'configure', 'clients', 'search'],
+        'operation': 'getOrganizationClientsSearch'
+    }
+
+    # First page (SDK request keeps rate limit handling and raises APIError)
+    response = dashboard._session.request(metadata, 'GET', f'/organizations/{org_id}/clients/search',
+                                          params={'mac': mac})
+    results = response.json()
+
+    # Follow next links, merge records
+    while 'next' in response.links:
+        response = dashboard._session.request(metadata, 'GET', response.links['next']['url'])
+        results['records'].extend(response.json().get('records', []))
+
+    return results
+
+
+async def _open_aio_dashboard():
+    """
+    Create the async dashboard instance (its aiohttp session must be created on the loop that uses it)
+    :return: Async dashboard instance
+    """
+    return meraki.aio.AsyncDashboardAPI(api_key=MERAKI_API_KEY, suppress_logging=True,
+                                        maximum_concurrent_requests=MAX_CONCURRENT_REQUESTS,
+                                        wait_on_rate_limit=True, maximum_retries=MAXIMUM_RETRIES)
+
+
+def run_async(coroutine):
+    """
+    Run coroutine on the shared background event loop (loop and async dashboard started on first use)
+    :param coroutine: Coroutine to run
+    :return: Coroutine result
+    """
+    global _aio_loop, _aiomeraki
+
+    with _aio_lock:
+        if _aio_loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name='meraki-aio', daemon=True).start()
+
+            _aiomeraki = asyncio.run_coroutine_threadsafe(_open_aio_dashboard(), loop).result()
+            _aio_loop = loop
+
+    return asyncio.run_coroutine_threadsafe(coroutine, _aio_loop).result()
+
+
+def retry_wait(error, attempt):
+    """
+    Seconds to wait before retrying a rate limited call (Retry-After header, else exponential backoff)
+    :param error: API error (status 429)
+    :param attempt: Retry attempt (0 first)
+    :return: Seconds to wait
+    """
+    headers = getattr(error.response, 'headers', None) or {}
+    try:
+        return int(headers['Retry-After'])
+    except (KeyError, ValueError):
+        return 2 ** attempt
+
+
+def print_not_found(not_found):
+    """
+    Print one summary line for all networks where the client was not found
+    :param not_found: List of network names
+    """
+    if not_found:
+        console.print(f'[red]Client Not Found [/] in {len(not_found)} networks: {", ".join(not_found)}.',
+                      highlight=False)
+
+
 class MerakiClientInfo:
     def __init__(self, mac, time_period):
         self.mac = mac
         self.time_period = time_period
-        self.net_ids = get_network_ids(ORG_NAME)
+        self.org_id = _resolve_org_id()
+        self.net_ids = get_network_ids(self.org_id)
+        if self.net_ids is not None:
+            # Only query networks that can have this client (networks without productTypes are kept)
+            self.net_ids = tuple(network for network in self.net_ids
+                                 if not network[2] or not CLIENTLESS_PRODUCT_TYPES.issuperset(network[2]))
         self.sorted_net_names = sorted_list_network_names(self.net_ids)
         self.clientDetails = None
         self.usage = None
         self.usage_pie_chart = None
 
+        # Network IDs the client was seen in by client_detail_history (None -> not known, query every network)
+        self._networks_with_client = None
+
+    async def _fetch_networks(self, fetch, networks):
+        # Run fetch for every network over the shared async dashboard session (run via run_async, results in order)
+        return await asyncio.gather(*[fetch(_aiomeraki, network) for network in networks])
+
+    async def _fetch_app_usage(self, aiomeraki, network):
+        # Get client application usage in network at specific time range (API error returned instead of raised,
+        # still rate limited calls are retried after Retry-After). Only response[0] is used, so stop after page 1
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            try:
+                response = await aiomeraki.networks.getNetworkClientsApplicationUsage(
+                    network[0], self.mac, timespan=self.time_period, total_pages=1
+                )
+            except AsyncAPIError as a:
+                if a.status == 429 and attempt < RATE_LIMIT_RETRIES:
+                    await asyncio.sleep(retry_wait(a, attempt))
+                    continue
+                return network, None, a
+
+            return network, response, None
+
     def client_detail_history(self):
         # Set Client Details for client across networks (network specific)
 
@@ -150,46 +374,77 @@ class MerakiClientInfo:
             self.clientDetails = client_details
             return
 
+        try:
+            # Search client across the whole org in one call (replaces one call per network)
+            response = search_org_client(self.org_id, self.mac)
+        except APIError as a:
+            response = {'records': []}
+
+            if a.status == 404 or 'not found' in str(a.message).lower():
+                # Client not found in any network -> app usage skips every network
+                self._networks_with_client = set()
+            else:
+                # Real failure (auth, server error, ...) -> app usage still queries every network
+                console.print(f'[red]Client search failed[/] ({a.status} {a.reason}): {a.message}', highlight=False)
+                self._networks_with_client = None
+        else:
+            self._networks_with_client = set()
+
+        # Keep the most recent record per network seen in the time range (org search has no timespan filter)
+        seen_after = time.time() - self.time_period
+        records = {}
+        for record in response['records']:
+            last_seen = record.get('lastSeen') or 0
+            network_id = record['network']['id']
+
+            if last_seen >= seen_after and last_seen >= records.get(network_id, {}).get('lastSeen', 0):
+                records[network_id] = record
+
+        if self._networks_with_client is not None:
+            self._networks_with_client.update(records)
+
+        # Found networks and their client details (parallel lists, zipped into the output shape at the end)
+        names = []
+        details = []
+        not_found = []
         for network in self.net_ids:
-            try:
-                # Get client details in network for specific mac at specific time range
-                response = dashboard.networks.getNetworkClients(
-                    network[0], mac=self.mac, timespan=self.time_period, total_pages='all'
+            record = records.get(network[0])
+
+            if record:
+                console.print(f"Found Client Details Data in [blue]{network[1]}![/]", highlight=False)
+
+                # build client details record containing only relevant info
+                connection = record.get('recentDeviceConnection') or ('Wireless' if record.get('ssid') else 'Wired')
+                detail = ClientDetail(
+                    record.get('description'),
+                    record.get('ip'),
+                    response.get('mac', self.mac),
+                    record.get('user'),
+                    response.get('manufacturer'),
+                    record.get('os'),
+                    record.get('recentDeviceSerial'),
+                    record.get('recentDeviceName'),
+                    connection,
+                    record.get('status'),
+                    record.get('vlan', record.get('clientVlan'))
                 )
-            except APIError as a:
-                # Any type of error -> skip network (client not found)
-                console.print(f'[red]Client Not Found [/] in {network[1]}.')
-                continue
-
-            if len(response) > 0:
-                console.print(f"Found Client Details Data in [blue]{network[1]}![/]")
-
-                # build new client details dictionary containing only relevant info
-                client_details_minimized = {
-                    "description": response[0]['description'],
-                    "ip": response[0]['ip'],
-                    "mac": response[0]['mac'],
-                    "user": response[0]['user'],
-                    'manufacturer': response[0]['manufacturer'],
-                    'os': response[0]['os'],
-                    'recentDeviceSerial': response[0]['recentDeviceSerial'],
-                    'recentDeviceName': response[0]['recentDeviceName'],
-                    'recentDeviceConnection': response[0]['recentDeviceConnection'],
-                    'status': response[0]['status'],
-                    'vlan': response[0]['vlan']
-                }
 
                 # if wireless, include ssid, else include switch port
-                if client_details_minimized['recentDeviceConnection'] == 'Wireless':
-                    client_details_minimized['ssid'] = response[0]['ssid']
+                if connection == 'Wireless':
+                    detail.ssid = record.get('ssid')
                 else:
-                    client_details_minimized['switchport'] = response[0]['switchport']
+                    detail.switchport = record.get('switchport')
 
-                net_client_details = {"network_name": network[1], "client_details": client_details_minimized}
-                client_details['networks'].append(net_client_details)
+                names.append(network[1])
+                details.append(detail)
 
             else:
-                console.print(f'[red]Client Not Found [/] in {network[1]}.')
+                not_found.append(network[1])
+
+        print_not_found(not_found)
+
+        client_details['networks'] = [{"network_name": name, "client_details": detail}
+                                      for name, detail in zip(names, details)]
 
         self.clientDetails = client_details
 
@@ -208,14 +463,26 @@ class MerakiClientInfo:
             self.usage = app_usage
             return
 
+        # Summed raw usage per app across networks: {name: [received, sent]}
+        summary_usage = defaultdict(lambda: [0, 0])
+
+        # Only query networks the client was seen in, if client details were gathered first
+        networks = self.net_ids
+        if self._networks_with_client is not None:
+            networks = [network for network in self.net_ids if network[0] in self._networks_with_client]
+
+        # Query networks concurrently
+        results = run_async(self._fetch_networks(self._fetch_app_usage, networks))
+        fetched = {network[0]: (response, a) for network, response, a in results}
+
+        not_found = []
         for network in self.net_ids:
-            try:
-                response = dashboard.networks.getNetworkClientsApplicationUsage(
-                    network[0], self.mac, timespan=self.time_period, total_pages='all'
-                )
-            except APIError as a:
-                if 'not found' in a.message['errors'][0]:
-                    console.print(f'[red]Client Not Found [/] in {network[1]}.')
+            # Networks that were skipped count as not found
+            response, a = fetched.get(network[0], (None, None))
+
+            if response is None:
+                if a is None or 'not found' in a.message['errors'][0]:
+                    not_found.append(network[1])
 
                     # Log Network, and empty applications list
                     app_usage['networks'].append({"network_name": network[1], "applications": {}})
@@ -225,62 +492,60 @@ class MerakiClientInfo:
                 else:
                     return
 
-            # Sort returned applications alphabetically
+            # Sort returned applications alphabetically (network tables and Excel sheets list apps in this order,
+            # sort key computed once per app)
             applications = sorted(response[0]['applicationUsage'], key=lambda d: d['application'].lower())
 
             console.print(
-                f"Found usage Data in [blue]{network[1]}[/] for [yellow]{len(applications)} applications![/]")
+                f"Found usage Data in [blue]{network[1]}[/] for [yellow]{len(applications)} applications![/]",
+                highlight=False)
 
             # Summarize usage data across networks, track data per network
             net_app_usage = {"network_name": network[1], "applications": {}}
             net_app_usage_pie_chart = {"network_name": network[1], "applications": {}}
 
-            for application in applications:
+            # Translate bytes to appropriate value for all applications at once
+            received = convert_bytes_array([application['received'] for application in applications])
+            sent = convert_bytes_array([application['sent'] for application in applications])
+
+            for application, received_converted, sent_converted in zip(applications, received, sent):
                 name = application['application']
 
-                # Append to Network Dictionary (translate bytes to appropriate value)
-                net_app_usage['applications'][name] = [convert_bytes(application['received']),
-                                                       convert_bytes(application['sent'])]
+                # Append to Network Dictionary
+                net_app_usage['applications'][name] = [received_converted, sent_converted]
 
-                # Append to pie chart dictionary (change name to special format)
-                new_name = create_pie_chart_key(name, application['received'], application['sent'])
-                net_app_usage_pie_chart['applications'][new_name] = round(application['received'] + application['sent'],
-                                                                          1)
+                # Append to pie chart dictionary (name changed to special format once top apps are selected)
+                net_app_usage_pie_chart['applications'][name] = round(application['received'] + application['sent'], 1)
 
                 # Append to Summary Dictionary (conversion done after summation)
-                if name not in app_usage['summary']:
-                    app_usage['summary'][name] = [application['received'], application['sent']]
-
-                    # # Append to Summary Pie Chart
-                    # app_usage_pie_chart['summary'][name] = round(application['received'] + application['sent'], 1)
-                else:
-                    app_usage['summary'][name][0] += application['received']
-                    app_usage['summary'][name][1] += application['sent']
-
-                    # # Append to Summary Pie Chart
-                    # app_usage_pie_chart['summary'][name] += round(application['received'] + application['sent'], 1)
+                entry = summary_usage[name]
+                entry[0] += application['received']
+                entry[1] += application['sent']
 
             # Add network info to app usage dictionary
             app_usage['networks'].append(net_app_usage)
 
             # Organize App Usage Values with the largest first
-            net_app_usage_pie_chart['applications'] = create_pie_chart_values(net_app_usage_pie_chart['applications'])
+            net_app_usage_pie_chart['applications'] = create_pie_chart_values(
+                net_app_usage_pie_chart['applications'],
+                lambda name, total: create_pie_chart_key(name, total, *net_app_usage['applications'][name]))
             app_usage_pie_chart['networks'].append(net_app_usage_pie_chart)
 
-        # Convert summary app usage data bytes to appropriate value
-        for app in app_usage['summary']:
-            raw_received = app_usage['summary'][app][0]
-            raw_sent = app_usage['summary'][app][1]
+        print_not_found(not_found)
 
-            app_usage['summary'][app][0] = convert_bytes(raw_received)
-            app_usage['summary'][app][1] = convert_bytes(raw_sent)
+        # Convert summary app usage data bytes to appropriate value (all apps at once, back to a plain dict)
+        summary = app_usage['summary'] = dict(summary_usage)
+        received = convert_bytes_array([usage[0] for usage in summary.values()])
+        sent = convert_bytes_array([usage[1] for usage in summary.values()])
 
-            # Build New names for Summary Apps, add entries
-            new_name = create_pie_chart_key(app, raw_received, raw_sent)
-            app_usage_pie_chart['summary'][new_name] = round(raw_received + raw_sent, 1)
+        # Single pass: converted values and pie chart entry per summary app
+        for (app, (raw_received, raw_sent)), received_converted, sent_converted in zip(summary.items(), received, sent):
+            summary[app] = [received_converted, sent_converted]
+            app_usage_pie_chart['summary'][app] = round(raw_received + raw_sent, 1)
 
-        # Organize App Usage Values with the largest first
-        app_usage_pie_chart['summary'] = create_pie_chart_values(app_usage_pie_chart['summary'])
+        # Organize App Usage Values with the largest first (build New names for selected Summary Apps)
+        app_usage_pie_chart['summary'] = create_pie_chart_values(
+            app_usage_pie_chart['summary'], lambda name, total: create_pie_chart_key(name, total, *summary[name]))
 
         self.usage = app_usage
         self.usage_pie_chart = app_usage_pie_chart